@@ -1,18 +1,24 @@
 import numpy as np
-from scipy.special import logsumexp
 
 from scipy.stats import norm
 
+import mcts_numba
+
 
 class MCTS:
-    def __init__(self, exploration_coeff, algorithm, tau, alpha, step_size, gamma, update_type):
+    def __init__(self, exploration_coeff, algorithm, tau, alpha, step_size, gamma, update_type, jit=True):
         self._exploration_coeff = exploration_coeff
         self._algorithm = algorithm
         self._tau = tau
+        self._inv_tau = 1. / tau
         self._alpha = alpha
         self._step_size = step_size
         self._gamma = gamma  # discount factor
         self._update_type = update_type
+        self._jit = jit  # whether to run the compiled simulation kernel of mcts_numba
+        # Buffers written by the select policy, sized for the tree being searched by _allocate_buffers.
+        self._q_exp_tau = None
+        self._scratch = None
 
     def run(self, tree_env, n_simulations):
         """Runs a given number of MCTS simulations on the tree environment, keeping track of root values and regret.
@@ -22,14 +28,108 @@ class MCTS:
         Returns:
             An array of root values and cumulative regret for each simulation.
         """
+        if self._jit:
+            return self._run_jit(tree_env, n_simulations)
+
         v_hat = np.zeros(n_simulations)
         regret = np.zeros_like(v_hat)
+        noise = np.random.standard_normal(n_simulations)
+        self._allocate_buffers(tree_env)
         for i in range(n_simulations):
             tree_env.reset()
-            v_hat[i], regret[i] = self._simulation(tree_env)
+            v_hat[i], regret[i] = self._simulation(tree_env, noise[i])
 
         return v_hat, regret.cumsum()
 
+    def run_batched(self, tree_env, n_simulations, batch=32):
+        """Runs MCTS simulations in mini-batches that are selected and backed up together (leaf parallelization).
+
+        All simulations of a batch navigate the tree with the same snapshot of the statistics, one vectorized selection
+        per depth level, and are then backed up at once. This trades some statistical efficiency for speed, since the
+        simulations of a batch cannot see each other's results. Only supported for uct.
+        Args:
+            tree_env: The tree environment on which to run MCTS.
+            n_simulations: The number of simulations to run.
+            batch: The number of simulations per mini-batch.
+        Returns:
+            An array of root values and cumulative regret for each simulation.
+        """
+        if self._algorithm != 'uct':
+            raise ValueError
+
+        self._allocate_buffers(tree_env)
+        k = tree_env.k
+        actions = np.arange(k)
+        v_hat = np.zeros(n_simulations)
+        regret = np.zeros_like(v_hat)
+        for start in range(0, n_simulations, batch):
+            end = min(start + batch, n_simulations)
+            path_states = np.zeros((tree_env.d + 1, end - start), dtype=int)
+            for depth in range(tree_env.d):
+                edges = path_states[depth, :, None] * k + actions
+                n_state_action = tree_env.N_edge[edges]
+                n_state = n_state_action.sum(axis=1, keepdims=True)
+                ucb_values = np.where(
+                    n_state > 0,
+                    tree_env.Q_edge[edges] + self._exploration_coeff * np.sqrt(
+                        np.log(np.maximum(n_state, 1)) / (n_state_action + 1e-10)
+                    ),
+                    np.inf
+                )
+
+                # Random tie-breaking among the maximizing actions of each row.
+                ties = ucb_values == ucb_values.max(axis=1, keepdims=True)
+                chosen_actions = np.argmax(ties * np.random.random(ties.shape), axis=1)
+                path_states[depth + 1] = path_states[depth] * k + chosen_actions + 1
+
+            leaves, inverse, counts = np.unique(path_states[-1], return_inverse=True, return_counts=True)
+            rewards = tree_env.rollout(path_states[-1], np.random.standard_normal(end - start))
+            tree_env.V_node[leaves] = (tree_env.V_node[leaves] * tree_env.N_node[leaves] +
+                                       np.bincount(inverse, weights=rewards)) / (tree_env.N_node[leaves] + counts)
+            tree_env.N_node[leaves] += counts
+
+            for depth in reversed(range(tree_env.d)):
+                edges = path_states[depth + 1] - 1
+                tree_env.Q_edge[edges] = tree_env.V_node[path_states[depth + 1]]
+                tree_env.Q_tau_edge[edges] = tree_env.Q_edge[edges] * self._inv_tau
+                np.add.at(tree_env.N_edge, edges, 1)
+
+                states, inverse, counts = np.unique(path_states[depth], return_inverse=True, return_counts=True)
+                tree_env.V_node[states] = (tree_env.V_node[states] * tree_env.N_node[states] +
+                                           np.bincount(inverse, weights=tree_env.Q_edge[edges])) / \
+                    (tree_env.N_node[states] + counts)
+                tree_env.N_node[states] += counts
+
+            v_hat[start:end] = tree_env.V_node[0]
+            max_a, _ = self._select(tree_env=tree_env, state=0, depth=0)
+            regret[start:end] = tree_env.q_root.max() - tree_env.q_root[max_a]
+
+        return v_hat, regret.cumsum()
+
+    def _allocate_buffers(self, tree_env):
+        """Allocates the buffers reused by every simulation on the given tree: the exponentials cached by the select
+        policy at each depth of the path, and the per-action values the actions are chosen from.
+        Args:
+            tree_env: The tree environment that is going to be searched.
+        """
+        self._q_exp_tau = np.empty((tree_env.d, tree_env.k))
+        self._scratch = np.empty(tree_env.k)
+
+    def _run_jit(self, tree_env, n_simulations):
+        """Runs the simulations with the compiled kernel of mcts_numba, operating on the arrays of the tree in place.
+
+        The random number generator of the kernel is seeded from the numpy one, so that runs stay reproducible.
+        """
+        mcts_numba.seed(np.random.randint(2 ** 31))
+
+        return mcts_numba.run(n_simulations, tree_env.k, tree_env.d, tree_env.first_leaf_idx, tree_env.rollout_std,
+                              mcts_numba.ALGORITHMS[self._algorithm], self._exploration_coeff, self._tau,
+                              self._inv_tau, self._alpha, self._gamma, self._update_type == 'max',
+                              tree_env.mean_node, tree_env.q_root, tree_env.N_node, tree_env.V_node, tree_env.N_edge,
+                              tree_env.Q_edge, tree_env.Q_tau_edge, tree_env.prior_edge, tree_env.q_mean_edge,
+                              tree_env.q_variance_edge, tree_env.v_mean_node, tree_env.v_variance_node,
+                              tree_env.mu_node, tree_env.lambda_node, tree_env.alpha_node, tree_env.beta_node)
+
     @staticmethod
     def _compute_prob_max(mean_list, sigma_list):
         n_actions = len(mean_list)
@@ -67,138 +167,149 @@ class MCTS:
                 print(sigma_list)
                 input()
 
-    def _simulation(self, tree_env):
+    @staticmethod
+    def _sparse_max_support(q_tau):
+        """Computes the support of the sparse-max distribution over q_tau with a single argsort and cumulative sum.
+        Args:
+            q_tau: The action values divided by the temperature.
+        Returns:
+            The indices of the actions in the support and the sparse-max threshold.
+        """
+        order = np.argsort(q_tau)[::-1]
+        sorted_q = q_tau[order]
+        cumsum_q = np.cumsum(sorted_q)
+        k_support = (1 + np.arange(1, len(q_tau) + 1) * sorted_q > cumsum_q).sum()
+        kappa = order[:k_support]
+
+        return kappa, (cumsum_q[k_support - 1] - 1) / k_support
+
+    def _simulation(self, tree_env, eps):
         """Runs a single MCTS simulation on the tree.
         Args:
             tree_env: The tree environment on which to run.
+            eps: The standard normal noise of the rollout.
         Returns:
             The resulting root node value and the regret.
         """
         path = self._navigate(tree_env)
 
-        leaf_node = tree_env.tree.nodes[path[-1][1]]
+        leaf = path[-1][1]
 
-        reward = tree_env.rollout(path[-1][1])
+        reward = tree_env.rollout(leaf, eps)
 
-        leaf_node['V'] = (leaf_node['V'] * leaf_node['N'] + reward) / (leaf_node['N'] + 1)
+        n_leaf = tree_env.N_node[leaf]
+        tree_env.V_node[leaf] = (tree_env.V_node[leaf] * n_leaf + reward) / (n_leaf + 1)
 
         if self._algorithm == "w-mcts":
-            leaf_node['v_mean'] = (leaf_node['v_mean'] * leaf_node['N'] + reward) / (leaf_node['N'] + 1)
-            if leaf_node['N'] == 1:
-                leaf_node['v_variance'] = 1./np.sqrt(12)
+            tree_env.v_mean_node[leaf] = (tree_env.v_mean_node[leaf] * n_leaf + reward) / (n_leaf + 1)
+            if n_leaf == 1:
+                tree_env.v_variance_node[leaf] = 1./np.sqrt(12)
             else:
-                leaf_node['v_variance'] = (leaf_node['v_variance'] * leaf_node['N'] +
-                                           (reward - leaf_node['v_mean'])**2) / (leaf_node['N'] + 1)
+                tree_env.v_variance_node[leaf] = (tree_env.v_variance_node[leaf] * n_leaf +
+                                                  (reward - tree_env.v_mean_node[leaf])**2) / (n_leaf + 1)
         elif self._algorithm == "dng":
-            leaf_node["alpha"] += .5
-            leaf_node["beta"] += .5 * (leaf_node["lambda"]*(reward - leaf_node["mu"])**2
-                                       / (leaf_node["lambda"] + 1))
-            leaf_node["mu"] = ((leaf_node["lambda"]*leaf_node["mu"] + reward)
-                               / (leaf_node["lambda"] + 1))
-            leaf_node["lambda"] += 1
+            tree_env.alpha_node[leaf] += .5
+            tree_env.beta_node[leaf] += .5 * (tree_env.lambda_node[leaf]*(reward - tree_env.mu_node[leaf])**2
+                                              / (tree_env.lambda_node[leaf] + 1))
+            tree_env.mu_node[leaf] = ((tree_env.lambda_node[leaf]*tree_env.mu_node[leaf] + reward)
+                                      / (tree_env.lambda_node[leaf] + 1))
+            tree_env.lambda_node[leaf] += 1
 
-        leaf_node['N'] += 1
+        tree_env.N_node[leaf] += 1
 
-        for step, e in enumerate(reversed(path)):
-            current_node = tree_env.tree.nodes[e[0]]
-            next_node = tree_env.tree.nodes[e[1]]
+        for step, (state, next_state, cache) in enumerate(reversed(path)):
+            edge = next_state - 1
+            edges = tree_env.edges(state)
 
-            tree_env.tree[e[0]][e[1]]['Q'] = next_node['V']
-            tree_env.tree[e[0]][e[1]]['N'] += 1
+            tree_env.Q_edge[edge] = tree_env.V_node[next_state]
+            tree_env.Q_tau_edge[edge] = tree_env.Q_edge[edge] * self._inv_tau
+            tree_env.N_edge[edge] += 1
 
             if self._algorithm == 'w-mcts':
-                q_mean = tree_env.tree[e[0]][e[1]]['q_mean']
-                q_variance = tree_env.tree[e[0]][e[1]]['q_variance']
-                v_mean = next_node['v_mean']
-                v_variance = next_node['v_variance']
+                q_mean = tree_env.q_mean_edge[edge]
+                q_variance = tree_env.q_variance_edge[edge]
+                v_mean = tree_env.v_mean_node[next_state]
+                v_variance = tree_env.v_variance_node[next_state]
 
-                t = tree_env.tree[e[0]][e[1]]['N']
+                t = tree_env.N_edge[edge]
                 # _step_size = 1./np.power(t, self._step_size)
                 _step_size = 0
 
-                tree_env.tree[e[0]][e[1]]['q_mean'] = _step_size * q_mean + \
+                tree_env.q_mean_edge[edge] = _step_size * q_mean + \
                     (1 - _step_size) * self._gamma * v_mean
-                tree_env.tree[e[0]][e[1]]['q_variance'] = _step_size * q_variance + \
+                tree_env.q_variance_edge[edge] = _step_size * q_variance + \
                     (1 - _step_size) * (self._gamma * v_variance)
 
-                out_edges = [e for e in tree_env.tree.edges(e[0])]
-
-                mean_next_all = [tree_env.tree[e[0]][e[1]]['q_mean'] for e in out_edges]
-                variance_next_all = [tree_env.tree[e[0]][e[1]]['q_variance'] for e in out_edges]
-
-                mean_next_all = np.array(mean_next_all)
-                variance_next_all = np.array(variance_next_all)
+                mean_next_all = tree_env.q_mean_edge[edges]
+                variance_next_all = tree_env.q_variance_edge[edges]
 
                 if self._update_type == 'max':
                     best = np.random.choice(np.argwhere(mean_next_all == np.max(mean_next_all)).ravel())
-                    current_node['v_mean'] = mean_next_all[best]
-                    current_node['v_variance'] = variance_next_all[best]
+                    tree_env.v_mean_node[state] = mean_next_all[best]
+                    tree_env.v_variance_node[state] = variance_next_all[best]
                 else:
                     prob = self._compute_prob_max(mean_next_all, variance_next_all)
 
-                    current_node['v_mean'] = np.sum(mean_next_all * prob)
-                    current_node['v_variance'] = np.sum(variance_next_all * prob)
+                    tree_env.v_mean_node[state] = np.sum(mean_next_all * prob)
+                    tree_env.v_variance_node[state] = np.sum(variance_next_all * prob)
 
             elif self._algorithm == "dng":
                 cumulative_reward = self._gamma**step * reward
-                current_node["alpha"] += .5
-                current_node["beta"] += .5 * (current_node["lambda"]*(cumulative_reward - current_node["mu"])**2
-                                              / (current_node["lambda"] + 1))
-                current_node["mu"] = ((current_node["lambda"]*current_node["mu"] + cumulative_reward)
-                                      / (current_node["lambda"] + 1))
-                current_node["lambda"] += 1
+                lambda_state = tree_env.lambda_node[state]
+                tree_env.alpha_node[state] += .5
+                tree_env.beta_node[state] += .5 * (lambda_state*(cumulative_reward - tree_env.mu_node[state])**2
+                                                   / (lambda_state + 1))
+                tree_env.mu_node[state] = ((lambda_state*tree_env.mu_node[state] + cumulative_reward)
+                                           / (lambda_state + 1))
+                tree_env.lambda_node[state] += 1
 
             elif self._algorithm == 'power-uct':
-                out_edges = [e for e in tree_env.tree.edges(e[0])]
-                qs = np.array(
-                    [tree_env.tree[e[0]][e[1]]['Q'] for e in out_edges])
-                current_node['V'] = np.power(np.sum(np.power(qs, self._alpha)), self._alpha)
+                qs = tree_env.Q_edge[edges]
+                tree_env.V_node[state] = np.power(np.sum(np.power(qs, self._alpha)), self._alpha)
 
             elif self._algorithm == 'uct':
-                current_node['V'] = (current_node['V'] * current_node['N'] +
-                                     tree_env.tree[e[0]][e[1]]['Q']) / (current_node['N'] + 1)
+                tree_env.V_node[state] = (tree_env.V_node[state] * tree_env.N_node[state] +
+                                          tree_env.Q_edge[edge]) / (tree_env.N_node[state] + 1)
             else:
-                out_edges = [e for e in tree_env.tree.edges(e[0])]
-                qs = np.array(
-                    [tree_env.tree[e[0]][e[1]]['Q'] for e in out_edges])
+                q_tau = tree_env.Q_tau_edge[edges]
+                if self._algorithm == 'ments' or self._algorithm == 'rents':
+                    # Only the backed up edge changed since selecting in this state, so only its exponential is
+                    # recomputed, unless it exceeds the maximum the exponentials are shifted by.
+                    max_q_tau, q_exp_tau = cache
+                    action = edge - edges.start
+                    if q_tau[action] > max_q_tau:
+                        max_q_tau = q_tau[action]
+                        np.exp(np.subtract(q_tau, max_q_tau, out=q_exp_tau), out=q_exp_tau)
+                    else:
+                        q_exp_tau[action] = np.exp(q_tau[action] - max_q_tau)
+
                 if self._algorithm == 'ments':
-                    current_node['V'] = self._tau * logsumexp(qs / self._tau)
+                    tree_env.V_node[state] = self._tau * (max_q_tau + np.log(np.sum(q_exp_tau)))
                 elif self._algorithm == 'rents':
-                    qs_tau = qs / self._tau
-                    weighted_logsumexp_qs = qs_tau.max() + np.log(
-                        np.sum(current_node['prior'] * np.exp(qs_tau - qs_tau.max()))
+                    weighted_logsumexp_qs = max_q_tau + np.log(
+                        np.sum(np.multiply(tree_env.prior_edge[edges], q_exp_tau, out=self._scratch))
                     )
-                    current_node['V'] = self._tau * weighted_logsumexp_qs
+                    tree_env.V_node[state] = self._tau * weighted_logsumexp_qs
                 elif self._algorithm == 'tents':
-                    q_tau = qs / self._tau
-                    temp_q_tau = q_tau.copy()
-
-                    sorted_q = np.flip(np.sort(temp_q_tau))
-                    kappa = list()
-                    for i in range(1, len(sorted_q) + 1):
-                        if 1 + i * sorted_q[i-1] > sorted_q[:i].sum():
-                            idx = np.argwhere(temp_q_tau == sorted_q[i-1]).ravel()[0]
-                            temp_q_tau[idx] = np.nan
-                            kappa.append(idx)
-                    kappa = np.array(kappa)
-
-                    sparse_max = q_tau[kappa] ** 2 / 2 - (q_tau[kappa].sum() - 1) ** 2 / (2 * len(kappa) ** 2)
+                    kappa, threshold = self._sparse_max_support(q_tau)
+
+                    sparse_max = q_tau[kappa] ** 2 / 2 - threshold ** 2 / 2
                     sparse_max = sparse_max.sum() + .5
-                    current_node['V'] = self._tau * sparse_max
+                    tree_env.V_node[state] = self._tau * sparse_max
                 else:
                     raise ValueError
 
-            current_node['N'] += 1
+            tree_env.N_node[state] += 1
 
         v_hat = 0
         if self._algorithm == 'w-mcts':
-            v_hat = tree_env.tree.nodes[0]['v_mean']
+            v_hat = tree_env.v_mean_node[0]
         elif self._algorithm == "dng":
-            v_hat = tree_env.tree.nodes[0]["mu"]
+            v_hat = tree_env.mu_node[0]
         else:
-            v_hat = tree_env.tree.nodes[0]['V']
+            v_hat = tree_env.V_node[0]
 
-        max_a = self._select(tree_env=tree_env, state=0)
+        max_a, _ = self._select(tree_env=tree_env, state=0, depth=0)
         regret = tree_env.q_root.max() - tree_env.q_root[max_a]
 
         return v_hat, regret
@@ -208,35 +319,40 @@ class MCTS:
         Args:
             tree_env: The tree environment on which to operate.
         Returns:
-            An array of tuples, each containing the current state and the next state at each step of the path taken
-            through the tree.
+            An array of tuples, each containing the current state, the next state and the quantities cached by the
+            select policy at each step of the path taken through the tree.
         """
-        state = tree_env.state
-        action = self._select(tree_env, state)
-        next_state = tree_env.step(action)
-        if next_state not in tree_env.leaves:
-            return [[state, next_state]] + self._navigate(tree_env)
-        else:
-            return [[state, next_state]]
-
-    def _select(self, tree_env, state):
+        path = list()
+        while True:
+            state = tree_env.state
+            action, cache = self._select(tree_env, state, len(path))
+            next_state = tree_env.step(action)
+            path.append((state, next_state, cache))
+            if next_state >= tree_env.first_leaf_idx:
+                return path
+
+    def _select(self, tree_env, state, depth):
         """Policy for selecting nodes of the tree.
+
+        Writes into the per-instance buffers allocated by _allocate_buffers for tree_env, so it is not reentrant: the
+        buffers must be sized for tree_env.k, and selecting again at the same depth overwrites the exponentials cached
+        there, e.g. for the root at depth 0.
         Args:
             tree_env: The tree environment on which to operate.
             state: The state in which to select an action.
+            depth: The depth of the state, whose row of the exponentials buffer the select policy writes to.
         Returns:
-            The action that was chosen.
+            The action that was chosen and, for ments and rents, the maximum of the action values divided by the
+            temperature together with their shifted exponentials, which are reused when backing up the state.
         """
-        out_edges = [e for e in tree_env.tree.edges(state)]
-        n_state_action = np.array(
-            [tree_env.tree[e[0]][e[1]]['N'] for e in out_edges])
-        qs = np.array(
-            [tree_env.tree[e[0]][e[1]]['Q'] for e in out_edges])
+        edges = tree_env.edges(state)
+        n_state_action = tree_env.N_edge[edges]
+        qs = tree_env.Q_edge[edges]
 
         if self._algorithm == 'w-mcts':
 
-            # mean_next_all = np.array([tree_env.tree[e[0]][e[1]]['q_mean'] for e in out_edges])
-            # variance_next_all = np.array([tree_env.tree[e[0]][e[1]]['q_variance'] for e in out_edges])
+            # mean_next_all = tree_env.q_mean_edge[edges]
+            # variance_next_all = tree_env.q_variance_edge[edges]
             #
             # prob = self._compute_prob_max(mean_next_all, variance_next_all)
             #
@@ -244,26 +360,18 @@ class MCTS:
             #
             # return int(chosen_action[0])
 
-            qvalues = []
-            for edge in out_edges:
-                # Sample from normal gamma distribution
-                mu = tree_env.tree[edge[0]][edge[1]]['q_mean']
-                delta = tree_env.tree[edge[0]][edge[1]]['q_variance']
-
-                x = np.random.normal(mu, delta)
-
-                qvalues.append(x)
-            qvalues = np.array(qvalues)
+            # Sample from normal gamma distribution
+            qvalues = np.random.normal(tree_env.q_mean_edge[edges], tree_env.q_variance_edge[edges])
 
             chosen_action = np.random.choice(np.argwhere(qvalues == np.max(qvalues)).ravel())
             #
-            return chosen_action
+            return chosen_action, None
             # current implementation is ucb
             # mean_array = np.array(
-            #     [tree_env.tree[e[0]][e[1]]['q_mean'] for e in out_edges])
+            #     tree_env.q_mean_edge[edges])
             #
             # variance_array = np.array(
-            #     [tree_env.tree[e[0]][e[1]]['q_variance'] for e in out_edges])
+            #     tree_env.q_variance_edge[edges])
             #
             # n_state = np.sum(n_state_action)
             # if n_state > 0:
@@ -280,81 +388,82 @@ class MCTS:
             # return chosen_action
 
         elif self._algorithm == "dng":
-            qvalues = []
-            for edge in out_edges:
+            qvalues = self._scratch
+            for a, child in enumerate(tree_env.children[state]):
                 # Sample from normal gamma distribution
-                mu = tree_env.tree.nodes[edge[1]]["mu"]
-                alpha = tree_env.tree.nodes[edge[1]]["alpha"]
-                beta = tree_env.tree.nodes[edge[1]]["beta"]
-                ll = tree_env.tree.nodes[edge[1]]["lambda"]
+                mu = tree_env.mu_node[child]
+                alpha = tree_env.alpha_node[child]
+                beta = tree_env.beta_node[child]
+                ll = tree_env.lambda_node[child]
 
                 tau = np.random.gamma(alpha, 1/beta)
                 x = np.random.normal(mu, np.sqrt(1/(ll*tau)))
 
-                qvalues.append(x)
-            qvalues = np.array(qvalues)
+                qvalues[a] = x
 
             chosen_action = np.random.choice(np.argwhere(qvalues == np.max(qvalues)).ravel())
 
-            return chosen_action
+            return chosen_action, None
 
         elif self._algorithm == 'uct':
             n_state = np.sum(n_state_action)
+            ucb_values = self._scratch
             if n_state > 0:
-                ucb_values = qs + self._exploration_coeff * np.sqrt(
-                    np.log(n_state) / (n_state_action + 1e-10)
-                )
+                np.add(n_state_action, 1e-10, out=ucb_values)
+                np.sqrt(np.divide(np.log(n_state), ucb_values, out=ucb_values), out=ucb_values)
+                ucb_values *= self._exploration_coeff
+                ucb_values += qs
             else:
-                ucb_values = np.ones(len(n_state_action)) * np.inf
+                ucb_values.fill(np.inf)
 
             chosen_action = np.random.choice(np.argwhere(ucb_values == np.max(ucb_values)).ravel())
-            probs = np.zeros_like(ucb_values)
-            probs[chosen_action] += 1
 
-            return chosen_action
+            return chosen_action, None
         elif self._algorithm == 'power-uct':
             n_state = np.sum(n_state_action)
+            ucb_values = self._scratch
             if n_state > 0:
-                ucb_values = qs + self._exploration_coeff * np.sqrt(
-                    np.log(n_state) / (n_state_action + 1e-10)
-                )
+                np.add(n_state_action, 1e-10, out=ucb_values)
+                np.sqrt(np.divide(np.log(n_state), ucb_values, out=ucb_values), out=ucb_values)
+                ucb_values *= self._exploration_coeff
+                ucb_values += qs
             else:
-                ucb_values = np.ones(len(n_state_action)) * np.inf
+                ucb_values.fill(np.inf)
 
             chosen_action = np.random.choice(np.argwhere(ucb_values == np.max(ucb_values)).ravel())
-            probs = np.zeros_like(ucb_values)
-            probs[chosen_action] += 1
 
-            return chosen_action
+            return chosen_action, None
         else:
-            n_actions = len(out_edges)
+            n_actions = len(qs)
             lambda_coeff = np.clip(self._exploration_coeff * n_actions / np.log(
                 np.sum(n_state_action) + 1 + 1e-10), 0, 1)
 
-            if self._algorithm == 'ments':
-                q_exp_tau = np.exp(qs / self._tau)
-                probs = (1 - lambda_coeff) * q_exp_tau / q_exp_tau.sum() + lambda_coeff / n_actions
-            elif self._algorithm == 'rents':
-                qs_tau = qs / self._tau
-                prior_q_exp_tau = tree_env.tree.nodes[state]['prior'] * np.exp(qs_tau - qs_tau.max())
-                probs = (1 - lambda_coeff) * prior_q_exp_tau / (prior_q_exp_tau.sum()) + lambda_coeff / n_actions
+            cache = None
+            probs = self._scratch
+            if self._algorithm == 'ments' or self._algorithm == 'rents':
+                q_tau = tree_env.Q_tau_edge[edges]
+                q_exp_tau = self._q_exp_tau[depth]
+                max_q_tau = q_tau.max()
+                np.exp(np.subtract(q_tau, max_q_tau, out=q_exp_tau), out=q_exp_tau)
+                cache = max_q_tau, q_exp_tau
+                if self._algorithm == 'ments':
+                    probs[:] = q_exp_tau
+                else:
+                    np.multiply(tree_env.prior_edge[edges], q_exp_tau, out=probs)
+                normalizer = probs.sum()
+                probs *= 1 - lambda_coeff
+                probs /= normalizer
+                probs += lambda_coeff / n_actions
             elif self._algorithm == 'tents':
-                q_tau = qs / self._tau
-                temp_q_tau = q_tau.copy()
-
-                sorted_q = np.flip(np.sort(temp_q_tau))
-                kappa = list()
-                for i in range(1, len(sorted_q) + 1):
-                    if 1 + i * sorted_q[i-1] > sorted_q[:i].sum():
-                        idx = np.argwhere(temp_q_tau == sorted_q[i-1]).ravel()[0]
-                        temp_q_tau[idx] = np.nan
-                        kappa.append(idx)
-                kappa = np.array(kappa)
-
-                max_omega = np.maximum(q_tau - (q_tau[kappa].sum() - 1) / len(kappa),
-                                       np.zeros(len(q_tau)))
-                probs = (1 - lambda_coeff) * max_omega + lambda_coeff / n_actions
+                q_tau = tree_env.Q_tau_edge[edges]
+                _, threshold = self._sparse_max_support(q_tau)
+
+                np.maximum(np.subtract(q_tau, threshold, out=probs), 0, out=probs)
+                probs *= 1 - lambda_coeff
+                probs += lambda_coeff / n_actions
             else:
                 raise ValueError
 
-            return np.random.choice(np.arange(n_actions), p=probs)
+            cdf = np.cumsum(probs, out=probs)
+
+            return int(np.searchsorted(cdf, np.random.random() * cdf[-1], side='right')), cache
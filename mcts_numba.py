@@ -0,0 +1,327 @@
+import math
+
+import numpy as np
+from numba import njit
+
+UCT = 0
+POWER_UCT = 1
+MENTS = 2
+RENTS = 3
+TENTS = 4
+W_MCTS = 5
+DNG = 6
+
+ALGORITHMS = {'uct': UCT, 'power-uct': POWER_UCT, 'ments': MENTS, 'rents': RENTS, 'tents': TENTS, 'w-mcts': W_MCTS,
+              'dng': DNG}
+
+
+@njit(cache=True)
+def seed(s):
+    """Seeds the random number generator used inside of the compiled functions."""
+    np.random.seed(s)
+
+
+@njit(cache=True)
+def _random_argmax(values):
+    """Returns the index of the maximum of values, breaking ties uniformly at random."""
+    max_value = values.max()
+    n_ties = 0
+    for i in range(len(values)):
+        if values[i] == max_value:
+            n_ties += 1
+    chosen = np.random.randint(n_ties)
+    for i in range(len(values)):
+        if values[i] == max_value:
+            if chosen == 0:
+                return i
+            chosen -= 1
+
+    return len(values) - 1
+
+
+@njit(cache=True)
+def _sample(probs):
+    """Samples an index from the (possibly unnormalized) distribution probs."""
+    u = np.random.random() * probs.sum()
+    cumulative = 0.
+    for i in range(len(probs)):
+        cumulative += probs[i]
+        if u < cumulative:
+            return i
+
+    return len(probs) - 1
+
+
+@njit(cache=True)
+def _sparse_max_support(q_tau):
+    """Returns the indices of the actions in the support of the sparse-max distribution and its threshold."""
+    order = np.argsort(q_tau)[::-1]
+    cumulative = 0.
+    support_sum = 0.
+    k_support = 0
+    for i in range(len(order)):
+        cumulative += q_tau[order[i]]
+        if 1 + (i + 1) * q_tau[order[i]] > cumulative:
+            support_sum = cumulative
+            k_support = i + 1
+        else:
+            break
+
+    return order[:k_support], (support_sum - 1) / k_support
+
+
+@njit(cache=True)
+def _norm_pdf(x, loc, scale):
+    z = (x - loc) / scale
+
+    return math.exp(-.5 * z * z) / (scale * math.sqrt(2 * math.pi))
+
+
+@njit(cache=True)
+def _norm_cdf(x, loc, scale):
+    return .5 * (1 + math.erf((x - loc) / (scale * math.sqrt(2.))))
+
+
+@njit(cache=True)
+def _compute_prob_max(mean_list, sigma_list):
+    """Compiled counterpart of MCTS._compute_prob_max."""
+    n_actions = len(mean_list)
+    epsilon = 1e-5
+    _epsilon = 1e-25
+    n_trapz = 100
+    integrals = np.zeros(n_actions)
+    for j in range(n_actions):
+        if sigma_list[j] < epsilon:
+            p = 1.
+            for k in range(n_actions):
+                if k != j:
+                    p *= _norm_cdf(mean_list[j], mean_list[k], sigma_list[k] + _epsilon)
+            integrals[j] = p
+        else:
+            lower_limit = mean_list[j] - 8 * sigma_list[j]
+            upper_limit = mean_list[j] + 8 * sigma_list[j]
+            x = np.linspace(lower_limit, upper_limit, n_trapz)
+            y = np.empty(n_trapz)
+            for t in range(n_trapz):
+                y[t] = _norm_pdf(x[t], mean_list[j], sigma_list[j] + _epsilon)
+                for k in range(n_actions):
+                    if k != j:
+                        y[t] *= _norm_cdf(x[t], mean_list[k], sigma_list[k] + _epsilon)
+            integrals[j] = (upper_limit - lower_limit) / (2 * (n_trapz - 1)) * \
+                (y[0] + y[-1] + 2 * np.sum(y[1:-1]))
+
+    return integrals / np.sum(integrals)
+
+
+@njit(cache=True)
+def _select(state, k, algorithm, exploration_coeff, q_exp_tau, scratch, N_edge, Q_edge, Q_tau_edge, prior_edge,
+            q_mean_edge, q_variance_edge, mu_node, lambda_node, alpha_node, beta_node):
+    """Compiled counterpart of MCTS._select.
+
+    For ments and rents, the exponentials of the action values divided by the temperature, shifted by their maximum,
+    are written to q_exp_tau, so that they can be reused when backing up the state. The per-action values the action is
+    chosen from are written to scratch, so that no arrays are allocated.
+
+    Returns:
+        The action that was chosen and, for ments and rents, the maximum the exponentials are shifted by.
+    """
+    first_edge = state * k
+    n_state_action = N_edge[first_edge:first_edge + k]
+    qs = Q_edge[first_edge:first_edge + k]
+
+    if algorithm == W_MCTS:
+        for a in range(k):
+            scratch[a] = np.random.normal(q_mean_edge[first_edge + a], q_variance_edge[first_edge + a])
+
+        return _random_argmax(scratch), 0.
+    elif algorithm == DNG:
+        for a in range(k):
+            child = first_edge + a + 1
+            precision = np.random.gamma(alpha_node[child], 1 / beta_node[child])
+            scratch[a] = np.random.normal(mu_node[child], math.sqrt(1 / (lambda_node[child] * precision)))
+
+        return _random_argmax(scratch), 0.
+    elif algorithm == UCT or algorithm == POWER_UCT:
+        n_state = n_state_action.sum()
+        if n_state > 0:
+            log_n_state = math.log(n_state)
+            for a in range(k):
+                scratch[a] = qs[a] + exploration_coeff * math.sqrt(log_n_state / (n_state_action[a] + 1e-10))
+        else:
+            scratch[:] = np.inf
+
+        return _random_argmax(scratch), 0.
+    else:
+        lambda_coeff = min(max(exploration_coeff * k / math.log(n_state_action.sum() + 1 + 1e-10), 0.), 1.)
+
+        q_tau = Q_tau_edge[first_edge:first_edge + k]
+        max_q_tau = 0.
+        if algorithm == MENTS or algorithm == RENTS:
+            max_q_tau = q_tau.max()
+            for a in range(k):
+                q_exp_tau[a] = math.exp(q_tau[a] - max_q_tau)
+                scratch[a] = q_exp_tau[a] if algorithm == MENTS else prior_edge[first_edge + a] * q_exp_tau[a]
+            normalizer = scratch.sum()
+            for a in range(k):
+                scratch[a] = (1 - lambda_coeff) * scratch[a] / normalizer + lambda_coeff / k
+        else:
+            _, threshold = _sparse_max_support(q_tau)
+            for a in range(k):
+                scratch[a] = (1 - lambda_coeff) * max(q_tau[a] - threshold, 0.) + lambda_coeff / k
+
+        return _sample(scratch), max_q_tau
+
+
+@njit(cache=True)
+def _simulation(k, first_leaf_idx, noise, algorithm, exploration_coeff, tau, inv_tau, alpha, gamma, update_max,
+                path_states, path_actions, path_max_q_tau, path_q_exp_tau, scratch, mean_node, q_root, N_node, V_node,
+                N_edge, Q_edge, Q_tau_edge, prior_edge, q_mean_edge, q_variance_edge, v_mean_node, v_variance_node,
+                mu_node, lambda_node, alpha_node, beta_node):
+    """Compiled counterpart of MCTS._simulation.
+
+    Navigates the tree iteratively from the root to a leaf, storing the visited states, the chosen actions and the
+    exponentials computed by the select policy in the preallocated path arrays, and backs up the rollout return along
+    the path. The rollout return is the mean return of the reached leaf perturbed by the given noise.
+
+    Returns:
+        The resulting root node value and the regret.
+    """
+    state = 0
+    depth = 0
+    while state < first_leaf_idx:
+        action, path_max_q_tau[depth] = _select(state, k, algorithm, exploration_coeff, path_q_exp_tau[depth], scratch,
+                                                N_edge, Q_edge, Q_tau_edge, prior_edge, q_mean_edge, q_variance_edge,
+                                                mu_node, lambda_node, alpha_node, beta_node)
+        path_states[depth] = state
+        path_actions[depth] = action
+        state = state * k + action + 1
+        depth += 1
+
+    leaf = state
+    reward = mean_node[leaf] + noise
+
+    n_leaf = N_node[leaf]
+    V_node[leaf] = (V_node[leaf] * n_leaf + reward) / (n_leaf + 1)
+
+    if algorithm == W_MCTS:
+        v_mean_node[leaf] = (v_mean_node[leaf] * n_leaf + reward) / (n_leaf + 1)
+        if n_leaf == 1:
+            v_variance_node[leaf] = 1. / math.sqrt(12)
+        else:
+            v_variance_node[leaf] = (v_variance_node[leaf] * n_leaf +
+                                     (reward - v_mean_node[leaf]) ** 2) / (n_leaf + 1)
+    elif algorithm == DNG:
+        alpha_node[leaf] += .5
+        beta_node[leaf] += .5 * (lambda_node[leaf] * (reward - mu_node[leaf]) ** 2 / (lambda_node[leaf] + 1))
+        mu_node[leaf] = (lambda_node[leaf] * mu_node[leaf] + reward) / (lambda_node[leaf] + 1)
+        lambda_node[leaf] += 1
+
+    N_node[leaf] += 1
+
+    for step in range(depth):
+        state = path_states[depth - 1 - step]
+        action = path_actions[depth - 1 - step]
+        first_edge = state * k
+        edge = first_edge + action
+        next_state = edge + 1
+
+        Q_edge[edge] = V_node[next_state]
+        Q_tau_edge[edge] = Q_edge[edge] * inv_tau
+        N_edge[edge] += 1
+
+        if algorithm == W_MCTS:
+            q_mean_edge[edge] = gamma * v_mean_node[next_state]
+            q_variance_edge[edge] = gamma * v_variance_node[next_state]
+
+            mean_next_all = q_mean_edge[first_edge:first_edge + k]
+            variance_next_all = q_variance_edge[first_edge:first_edge + k]
+
+            if update_max:
+                best = _random_argmax(mean_next_all)
+                v_mean_node[state] = mean_next_all[best]
+                v_variance_node[state] = variance_next_all[best]
+            else:
+                prob = _compute_prob_max(mean_next_all, variance_next_all)
+                v_mean_node[state] = np.sum(mean_next_all * prob)
+                v_variance_node[state] = np.sum(variance_next_all * prob)
+        elif algorithm == DNG:
+            cumulative_reward = gamma ** step * reward
+            lambda_state = lambda_node[state]
+            alpha_node[state] += .5
+            beta_node[state] += .5 * (lambda_state * (cumulative_reward - mu_node[state]) ** 2 / (lambda_state + 1))
+            mu_node[state] = (lambda_state * mu_node[state] + cumulative_reward) / (lambda_state + 1)
+            lambda_node[state] += 1
+        elif algorithm == POWER_UCT:
+            qs = Q_edge[first_edge:first_edge + k]
+            V_node[state] = np.power(np.sum(np.power(qs, alpha)), alpha)
+        elif algorithm == UCT:
+            V_node[state] = (V_node[state] * N_node[state] + Q_edge[edge]) / (N_node[state] + 1)
+        else:
+            q_tau = Q_tau_edge[first_edge:first_edge + k]
+            if algorithm == MENTS or algorithm == RENTS:
+                # Only the backed up edge changed since selecting in this state, so only its exponential is
+                # recomputed, unless it exceeds the maximum the exponentials are shifted by.
+                max_q_tau = path_max_q_tau[depth - 1 - step]
+                q_exp_tau = path_q_exp_tau[depth - 1 - step]
+                if q_tau[action] > max_q_tau:
+                    max_q_tau = q_tau[action]
+                    for a in range(k):
+                        q_exp_tau[a] = math.exp(q_tau[a] - max_q_tau)
+                else:
+                    q_exp_tau[action] = math.exp(q_tau[action] - max_q_tau)
+
+            if algorithm == MENTS:
+                V_node[state] = tau * (max_q_tau + math.log(np.sum(q_exp_tau)))
+            elif algorithm == RENTS:
+                weighted_sum = 0.
+                for a in range(k):
+                    weighted_sum += prior_edge[first_edge + a] * q_exp_tau[a]
+                V_node[state] = tau * (max_q_tau + math.log(weighted_sum))
+            else:
+                kappa, threshold = _sparse_max_support(q_tau)
+                sparse_max = .5
+                for a in kappa:
+                    sparse_max += q_tau[a] ** 2 / 2 - threshold ** 2 / 2
+                V_node[state] = tau * sparse_max
+
+        N_node[state] += 1
+
+    if algorithm == W_MCTS:
+        v_hat = v_mean_node[0]
+    elif algorithm == DNG:
+        v_hat = mu_node[0]
+    else:
+        v_hat = V_node[0]
+
+    max_a, _ = _select(0, k, algorithm, exploration_coeff, path_q_exp_tau[0], scratch, N_edge, Q_edge, Q_tau_edge,
+                       prior_edge, q_mean_edge, q_variance_edge, mu_node, lambda_node, alpha_node, beta_node)
+    regret = q_root.max() - q_root[max_a]
+
+    return v_hat, regret
+
+
+@njit(cache=True)
+def run(n_simulations, k, d, first_leaf_idx, rollout_std, algorithm, exploration_coeff, tau, inv_tau, alpha, gamma,
+        update_max, mean_node, q_root, N_node, V_node, N_edge, Q_edge, Q_tau_edge, prior_edge, q_mean_edge,
+        q_variance_edge, v_mean_node, v_variance_node, mu_node, lambda_node, alpha_node, beta_node):
+    """Compiled counterpart of MCTS.run, sampling the noise of all rollouts at once.
+
+    Returns:
+        An array of root values and cumulative regret for each simulation.
+    """
+    path_states = np.empty(d, dtype=np.int64)
+    path_actions = np.empty(d, dtype=np.int64)
+    path_max_q_tau = np.empty(d)
+    path_q_exp_tau = np.empty((d, k))
+    scratch = np.empty(k)
+    noise = rollout_std * np.random.standard_normal(n_simulations)
+    v_hat = np.zeros(n_simulations)
+    regret = np.zeros(n_simulations)
+    for i in range(n_simulations):
+        v_hat[i], regret[i] = _simulation(k, first_leaf_idx, noise[i], algorithm, exploration_coeff, tau, inv_tau,
+                                          alpha, gamma, update_max, path_states, path_actions, path_max_q_tau,
+                                          path_q_exp_tau, scratch, mean_node, q_root, N_node, V_node, N_edge,
+                                          Q_edge, Q_tau_edge, prior_edge, q_mean_edge, q_variance_edge, v_mean_node,
+                                          v_variance_node, mu_node, lambda_node, alpha_node, beta_node)
+
+    return v_hat, regret.cumsum()
@@ -20,82 +20,50 @@ algs = ['uct', 'ments', 'rents', 'tents', 'w-mcts', 'dng']
 folder_name = 'logs/expl_%.2f_tau_%.2f' % (exploration_coeff, tau)
 
 # PLOTS
-plt.figure()
+metrics = ['diff', 'diff_uct', 'regret']
+ylabels = [r'$\varepsilon_\Omega$', r'$\varepsilon_{UCT}$', r'$R$']
+results = {(kk, dd, alg, metric): np.load(folder_name + '/k_%d_d_%d/%s_%s.npy' % (kk, dd, metric, alg))
+           for kk, dd in zip(k, d) for alg in algs for metric in metrics}
 
-count_plot = 0
-for kk, dd in zip(k, d):
-    max_diff = 0
-    max_diff_uct = 0
-    max_regret = 0
-    for alg in algs:
-        subfolder_name = folder_name + '/k_%d_d_%d' % (kk, dd)
-        diff = np.load(subfolder_name + '/diff_%s.npy' % (alg))
-        avg_diff = diff.mean(0)
-        plt.subplot(3, len(k), 1 + count_plot % len(k))
-        plt.title('k=%d  d=%d' % (kk, dd), fontsize='xx-large')
-        plt.tick_params(
-            axis='x',
-            which='both',
-            bottom=False,
-            top=False,
-            labelbottom=False)
-        plt.yticks(fontsize='xx-large')
-        if count_plot == 0:
-            plt.ylabel(r'$\varepsilon_\Omega$', fontsize='xx-large')
-        plt.plot(avg_diff, linewidth=3)
-        err = 2 * np.std(diff.reshape(n_exp * n_trees, n_simulations),
-                         axis=0) / np.sqrt(n_exp * n_trees)
-        plt.fill_between(np.arange(n_simulations), avg_diff - err, avg_diff + err,
-                         alpha=.5)
-        max_diff = max(max_diff, avg_diff.max())
+fig, axes = plt.subplots(len(metrics), len(k), squeeze=False)
+for col, (kk, dd) in enumerate(zip(k, d)):
+    axes[0, col].set_title('k=%d  d=%d' % (kk, dd), fontsize='xx-large')
+    for row, metric in enumerate(metrics):
+        ax = axes[row, col]
+        if row < len(metrics) - 1:
+            ax.tick_params(
+                axis='x',
+                which='both',
+                bottom=False,
+                top=False,
+                labelbottom=False)
+        else:
+            ax.set_xlabel('# Simulations', fontsize='xx-large')
+        ax.tick_params(axis='y', labelsize='xx-large')
+        if col == 0:
+            ax.set_ylabel(ylabels[row], fontsize='xx-large')
 
-        diff_uct = np.load(subfolder_name + '/diff_uct_%s.npy' % (alg))
-        avg_diff_uct = diff_uct.mean(0)
-        plt.subplot(3, len(k), len(k) + 1 + count_plot % len(k))
-        plt.tick_params(
-            axis='x',
-            which='both',
-            bottom=False,
-            top=False,
-            labelbottom=False)
-        plt.yticks(fontsize='xx-large')
-        if count_plot == 0:
-            plt.ylabel(r'$\varepsilon_{UCT}$', fontsize='xx-large')
-        plt.plot(avg_diff_uct, linewidth=3)
-        err = 2 * np.std(diff_uct.reshape(n_exp * n_trees, n_simulations),
-                         axis=0) / np.sqrt(n_exp * n_trees)
-        plt.fill_between(np.arange(n_simulations), avg_diff_uct - err,
-                         avg_diff_uct + err, alpha=.5)
-        max_diff_uct = max(max_diff_uct, avg_diff_uct.max())
+        max_value = 0
+        for alg in algs:
+            values = results[(kk, dd, alg, metric)]
+            avg_values = values.mean(0)
+            ax.plot(avg_values, linewidth=3)
+            err = 2 * np.std(values.reshape(n_exp * n_trees, n_simulations),
+                             axis=0) / np.sqrt(n_exp * n_trees)
+            ax.fill_between(np.arange(n_simulations), avg_values - err,
+                            avg_values + err, alpha=.5)
+            max_value = max(max_value, avg_values.max())
 
-        regret = np.load(subfolder_name + '/regret_%s.npy' % (alg))
-        avg_regret = regret.mean(0)
-        plt.subplot(3, len(k), 2 * len(k) + 1 + count_plot % len(k))
-        if count_plot == 0:
-            plt.ylabel(r'$R$', fontsize='xx-large')
-        plt.plot(avg_regret, linewidth=3)
-        err = 2 * np.std(regret.reshape(n_exp * n_trees, n_simulations),
-                         axis=0) / np.sqrt(n_exp * n_trees)
-        plt.fill_between(np.arange(n_simulations), avg_regret - err,
-                         avg_regret + err, alpha=.5)
-        max_regret = max(max_regret, avg_regret.max())
-        plt.xlabel('# Simulations', fontsize='xx-large')
-        plt.xticks([0, 5000, 10000], ['0', '5e3', '10e3'], fontsize='xx-large')
-        plt.yticks(fontsize='xx-large')
-        plots = [max_diff, max_diff_uct, max_regret]
+        if row == len(metrics) - 1:
+            ax.set_xticks([0, 5000, 10000])
+            ax.set_xticklabels(['0', '5e3', '10e3'], fontsize='xx-large')
+        ax.grid()
+        ax.set_ylim(0, max_value)
 
-    # plt.legend([alg.upper() for alg in algs], fontsize='xx-large', loc="upper center", bbox_to_anchor=(-0.3, -0.3), ncol=len(algs), frameon=False)
+    # axes[-1, col].legend([alg.upper() for alg in algs], fontsize='xx-large', loc="upper center", bbox_to_anchor=(-0.3, -0.3), ncol=len(algs), frameon=False)
 
-    for i in range(3):
-        plt.subplot(3, len(k), count_plot + 1 + i * len(k))
-        plt.grid()
-        plt.ylim(0, plots[i])
-
-    count_plot += 1
-
-plt.subplot(3, len(k), 3 * len(k) - 2)
-plt.legend([alg.upper() for alg in algs], fontsize='xx-large', loc="upper center",
-           bbox_to_anchor=(0.3, -0.3), ncol=len(algs), frameon=False)
+axes[-1, len(k) - 3].legend([alg.upper() for alg in algs], fontsize='xx-large', loc="upper center",
+                            bbox_to_anchor=(0.3, -0.3), ncol=len(algs), frameon=False)
 
 # HEATMAPS
 diff = np.load(folder_name + '/diff_heatmap.npy')
@@ -1,5 +1,9 @@
+import copy
+import os
 import pathlib
 import pickle
+import shutil
+import tempfile
 
 import numpy as np
 from joblib import Parallel, delayed
@@ -8,16 +12,21 @@ from mcts import MCTS
 from tree_env import SyntheticTree
 
 
-def experiment(algorithm, tree, epsilon):
+def experiment(algorithm, tree, epsilon, seed, out, i):
+    np.random.seed(seed.generate_state(1)[0])
+    tree = copy.deepcopy(tree)
     mcts = MCTS(exploration_coeff=epsilon,
                 algorithm=algorithm,
-                tau=tau)
+                tau=tau,
+                alpha=alpha,
+                step_size=step_size,
+                gamma=gamma,
+                update_type='mean')
 
     v_hat, regret = mcts.run(tree, n_simulations)
-    diff = np.abs(v_hat - tree.optimal_v_root)
-    diff_uct = np.abs(v_hat - tree.max_mean)
-
-    return diff, diff_uct, regret
+    out[0, i] = np.abs(v_hat - tree.optimal_v_root)
+    out[1, i] = np.abs(v_hat - tree.max_mean)
+    out[2, i] = regret
 
 
 n_exp = 5
@@ -27,6 +36,10 @@ k = 8
 d = 3
 epsilons = [.01, .025, .05, .075, .1, .25, .5, .75, 1.]
 taus = [.01, .025, .05, .075, .1, .25, .5, .75, 1.]
+alpha = .2
+gamma = 1.
+step_size = .5
+seed = 0
 algorithms = {'uct': 'UCT', 'ments': 'MENTS', 'rents': 'RENTS', 'tents': 'TENTS'}
 
 folder_name = './logs/k_%d_d_%d' % (k, d)
@@ -34,40 +47,55 @@ folder_name = './logs/k_%d_d_%d' % (k, d)
 diff_heatmap = np.zeros((len(algorithms), len(epsilons), len(taus)))
 diff_uct_heatmap = np.zeros_like(diff_heatmap)
 regret_heatmap = np.zeros_like(diff_heatmap)
-for x, eps in enumerate(epsilons):
-    for y, tau in enumerate(taus):
-        subfolder_name = folder_name + '/eps_%.3f_tau_%.3f' % (eps, tau)
-        pathlib.Path(subfolder_name).mkdir(parents=True, exist_ok=True)
-        for z, alg in enumerate(algorithms.keys()):
-            print('Epsilon: %.3f, Tau: %.3f, Alg: %s' % (eps, tau, alg))
-            out = list()
-            for w in range(n_trees):
-                try:
-                    with open(subfolder_name + '/tree%d_%s.pkl' % (w, alg), 'rb') as f:
-                        tree = pickle.load(f)
-                except FileNotFoundError as err:
-                    print('Tree not found! Creating new tree...')
-                    tree = SyntheticTree(k, d, alg, tau)
-                    with open(subfolder_name + '/tree%d_%s.pkl' % (w, alg), 'wb') as f:
-                        pickle.dump(tree, f)
+seed_sequence = np.random.SeedSequence(seed)
+# The workers write their curves in place into this file-backed array, which joblib hands to them by reference,
+# instead of pickling them back to the parent.
+out_folder = tempfile.mkdtemp()
+out = np.memmap(os.path.join(out_folder, 'out.mmap'), dtype=np.float64, mode='w+',
+                shape=(3, n_trees * n_exp, n_simulations))
+try:
+    for x, eps in enumerate(epsilons):
+        for y, tau in enumerate(taus):
+            subfolder_name = folder_name + '/eps_%.3f_tau_%.3f' % (eps, tau)
+            pathlib.Path(subfolder_name).mkdir(parents=True, exist_ok=True)
+            for z, alg in enumerate(algorithms.keys()):
+                print('Epsilon: %.3f, Tau: %.3f, Alg: %s' % (eps, tau, alg))
+                trees = list()
+                for w in range(n_trees):
+                    try:
+                        with open(subfolder_name + '/tree%d_%s.pkl' % (w, alg), 'rb') as f:
+                            tree = pickle.load(f)
+                    except FileNotFoundError as err:
+                        print('Tree not found! Creating new tree...')
+                        tree = SyntheticTree(k, d, alg, tau, alpha, gamma)
+                        with open(subfolder_name + '/tree%d_%s.pkl' % (w, alg), 'wb') as f:
+                            pickle.dump(tree, f)
+                    trees.append(tree)
 
-                out += Parallel(n_jobs=-1)(delayed(experiment)(alg, tree, eps) for _ in range(n_exp))
-            out = np.array(out)
+                # One task per (tree, experiment) pair, each with its own independent random stream.
+                tasks = [(w, e) for w in range(n_trees) for e in range(n_exp)]
+                seeds = seed_sequence.spawn(len(tasks))
+                Parallel(n_jobs=-1, backend='loky')(
+                    delayed(experiment)(alg, trees[w], eps, s, out, i)
+                    for i, ((w, _), s) in enumerate(zip(tasks, seeds)))
 
-            diff = out[:, 0]
-            diff_uct = out[:, 1]
-            regret = out[:, 2]
+                diff = out[0]
+                diff_uct = out[1]
+                regret = out[2]
 
-            avg_diff = diff.mean(0)
-            avg_diff_uct = diff_uct.mean(0)
-            avg_regret = regret.mean(0)
-            diff_heatmap[z, x, y] = avg_diff[-1]
-            diff_uct_heatmap[z, x, y] = avg_diff_uct[-1]
-            regret_heatmap[z, x, y] = avg_regret[-1]
+                avg_diff = diff.mean(0)
+                avg_diff_uct = diff_uct.mean(0)
+                avg_regret = regret.mean(0)
+                diff_heatmap[z, x, y] = avg_diff[-1]
+                diff_uct_heatmap[z, x, y] = avg_diff_uct[-1]
+                regret_heatmap[z, x, y] = avg_regret[-1]
 
-            np.save(subfolder_name + '/diff_%s.npy' % (alg), diff)
-            np.save(subfolder_name + '/diff_uct_%s.npy' % (alg), diff_uct)
-            np.save(subfolder_name + '/regret_%s.npy' % (alg), regret)
+                np.save(subfolder_name + '/diff_%s.npy' % (alg), diff)
+                np.save(subfolder_name + '/diff_uct_%s.npy' % (alg), diff_uct)
+                np.save(subfolder_name + '/regret_%s.npy' % (alg), regret)
+finally:
+    del out
+    shutil.rmtree(out_folder)
 
 np.save(folder_name + '/diff_heatmap.npy', diff_heatmap)
 np.save(folder_name + '/diff_uct_heatmap.npy', diff_uct_heatmap)
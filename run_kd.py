@@ -1,5 +1,9 @@
+import copy
+import os
 import pathlib
 import pickle
+import shutil
+import tempfile
 
 import numpy as np
 from joblib import Parallel, delayed
@@ -8,7 +12,9 @@ from mcts import MCTS
 from tree_env import SyntheticTree
 
 
-def experiment(algorithm, tree):
+def experiment(algorithm, tree, seed, out, i):
+    np.random.seed(seed.generate_state(1)[0])
+    tree = copy.deepcopy(tree)
     mcts = MCTS(exploration_coeff=exploration_coeff,
                 algorithm=algorithm,
                 tau=tau,
@@ -18,10 +24,9 @@ def experiment(algorithm, tree):
                 update_type='mean')
 
     v_hat, regret = mcts.run(tree, n_simulations)
-    diff = np.abs(v_hat - tree.optimal_v_root)
-    diff_uct = np.abs(v_hat - tree.max_mean)
-
-    return diff, diff_uct, regret
+    out[0, i] = np.abs(v_hat - tree.optimal_v_root)
+    out[1, i] = np.abs(v_hat - tree.max_mean)
+    out[2, i] = regret
 
 
 n_exp = 5
@@ -40,6 +45,7 @@ tau = .1
 alpha = .2
 gamma = 1.
 step_size = .5
+seed = 0
 # algorithms = {'uct': 'UCT', 'ments': 'MENTS', 'rents': 'RENTS', 'tents': 'TENTS', 'w-mcts': 'W-MCTS', 'dng': 'DNG'}
 
 algorithms = {'uct': 'UCT', 'w-mcts': 'W-MCTS', 'dng': 'DNG'}
@@ -49,40 +55,55 @@ folder_name = './logs/expl_%.2f_tau_%.2f' % (exploration_coeff, tau)
 diff_heatmap = np.zeros((len(algorithms), len(ks), len(ds)))
 diff_uct_heatmap = np.zeros_like(diff_heatmap)
 regret_heatmap = np.zeros_like(diff_heatmap)
-for x, k in enumerate(ks):
-    for y, d in enumerate(ds):
-        subfolder_name = folder_name + '/k_' + str(k) + '_d_' + str(d)
-        pathlib.Path(subfolder_name).mkdir(parents=True, exist_ok=True)
-        for z, alg in enumerate(algorithms.keys()):
-            print('Branching factor: %d, Depth: %d, Alg: %s' % (k, d, alg))
-            out = list()
-            for w in range(n_trees):
-                try:
-                    with open(subfolder_name + '/tree%d_%s.pkl' % (w, alg), 'rb') as f:
-                        tree = pickle.load(f)
-                except FileNotFoundError as err:
-                    print('Tree not found! Creating new tree...')
-                    tree = SyntheticTree(k, d, alg, tau, alpha, gamma)
-                    with open(subfolder_name + '/tree%d_%s.pkl' % (w, alg), 'wb') as f:
-                        pickle.dump(tree, f)
-
-                out += Parallel(n_jobs=-1)(delayed(experiment)(alg, tree) for _ in range(n_exp))
-            out = np.array(out)
-
-            diff = out[:, 0]
-            diff_uct = out[:, 1]
-            regret = out[:, 2]
-
-            avg_diff = diff.mean(0)
-            avg_diff_uct = diff_uct.mean(0)
-            avg_regret = regret.mean(0)
-            diff_heatmap[z, x, y] = avg_diff[-1]
-            diff_uct_heatmap[z, x, y] = avg_diff_uct[-1]
-            regret_heatmap[z, x, y] = avg_regret[-1]
-
-            np.save(subfolder_name + '/diff_%s.npy' % (alg), diff)
-            np.save(subfolder_name + '/diff_uct_%s.npy' % (alg), diff_uct)
-            np.save(subfolder_name + '/regret_%s.npy' % (alg), regret)
+seed_sequence = np.random.SeedSequence(seed)
+# The workers write their curves in place into this file-backed array, which joblib hands to them by reference,
+# instead of pickling them back to the parent.
+out_folder = tempfile.mkdtemp()
+out = np.memmap(os.path.join(out_folder, 'out.mmap'), dtype=np.float64, mode='w+',
+                shape=(3, n_trees * n_exp, n_simulations))
+try:
+    for x, k in enumerate(ks):
+        for y, d in enumerate(ds):
+            subfolder_name = folder_name + '/k_' + str(k) + '_d_' + str(d)
+            pathlib.Path(subfolder_name).mkdir(parents=True, exist_ok=True)
+            for z, alg in enumerate(algorithms.keys()):
+                print('Branching factor: %d, Depth: %d, Alg: %s' % (k, d, alg))
+                trees = list()
+                for w in range(n_trees):
+                    try:
+                        with open(subfolder_name + '/tree%d_%s.pkl' % (w, alg), 'rb') as f:
+                            tree = pickle.load(f)
+                    except FileNotFoundError as err:
+                        print('Tree not found! Creating new tree...')
+                        tree = SyntheticTree(k, d, alg, tau, alpha, gamma)
+                        with open(subfolder_name + '/tree%d_%s.pkl' % (w, alg), 'wb') as f:
+                            pickle.dump(tree, f)
+                    trees.append(tree)
+
+                # One task per (tree, experiment) pair, each with its own independent random stream.
+                tasks = [(w, e) for w in range(n_trees) for e in range(n_exp)]
+                seeds = seed_sequence.spawn(len(tasks))
+                Parallel(n_jobs=-1, backend='loky')(
+                    delayed(experiment)(alg, trees[w], s, out, i)
+                    for i, ((w, _), s) in enumerate(zip(tasks, seeds)))
+
+                diff = out[0]
+                diff_uct = out[1]
+                regret = out[2]
+
+                avg_diff = diff.mean(0)
+                avg_diff_uct = diff_uct.mean(0)
+                avg_regret = regret.mean(0)
+                diff_heatmap[z, x, y] = avg_diff[-1]
+                diff_uct_heatmap[z, x, y] = avg_diff_uct[-1]
+                regret_heatmap[z, x, y] = avg_regret[-1]
+
+                np.save(subfolder_name + '/diff_%s.npy' % (alg), diff)
+                np.save(subfolder_name + '/diff_uct_%s.npy' % (alg), diff_uct)
+                np.save(subfolder_name + '/regret_%s.npy' % (alg), regret)
+finally:
+    del out
+    shutil.rmtree(out_folder)
 
 np.save(folder_name + '/diff_heatmap.npy', diff_heatmap)
 np.save(folder_name + '/diff_uct_heatmap.npy', diff_uct_heatmap)
@@ -1,11 +1,16 @@
-import networkx as nx
 import numpy as np
 
 from scipy.special import logsumexp
 
 
+# Q_tau is Q divided by the temperature of the MCTS run on the tree.
+EDGE_STATS_DTYPE = np.dtype([('N', np.int64), ('Q', np.float64), ('Q_tau', np.float64)])
+# Half the width, for trees with a large branching factor where reading the edge statistics dominates selection.
+COMPACT_EDGE_STATS_DTYPE = np.dtype([('N', np.int32), ('Q', np.float32), ('Q_tau', np.float32)])
+
+
 class SyntheticTree:
-    def __init__(self, k, d, algorithm, tau, alpha, gamma):
+    def __init__(self, k, d, algorithm, tau, alpha, gamma, compact=False):
         """
         Args:
             k (int): Branching factor of the tree.
@@ -14,6 +19,7 @@ class SyntheticTree:
             tau (float):
             alpha (float):
             gamma (float):
+            compact (bool): Whether to store the edge statistics in 32 bits instead of 64 bits.
         """
         self._k = k
         self._d = d
@@ -23,42 +29,49 @@ class SyntheticTree:
         self._gamma = gamma
 
 
-        self._tree = nx.balanced_tree(k, d, create_using=nx.DiGraph)
-        random_weights = np.random.rand(len(self._tree.edges))
-        for i, e in enumerate(self._tree.edges):
-            self._tree[e[0]][e[1]]['weight'] = random_weights[i]
-            self._tree[e[0]][e[1]]['N'] = 0
-            self._tree[e[0]][e[1]]['Q'] = 0.
+        # The nodes at depth l are level_starts[l], ..., level_starts[l + 1] - 1.
+        self._level_starts = [(k ** l - 1) // (k - 1) if k > 1 else l for l in range(d + 2)]
+        self.n_nodes = self._level_starts[-1]
+        self.first_leaf_idx = self._level_starts[-2]
+        self.n_edges = self.n_nodes - 1
+        # children[n] holds the ids of the children of the non-leaf node n.
+        self.children = np.arange(1, self.n_nodes).reshape(self.first_leaf_idx, k)
+
+        # Nodes are numbered in breadth-first order, so the children of node n are k*n+1, ..., k*n+k and the edge
+        # taking action a in node n has id n*k + a.
+        self.weight_edge = np.random.rand(self.n_edges)
+        # The statistics read together on every visit are interleaved in one structured array. N_edge, Q_edge and
+        # Q_tau_edge are views on its fields.
+        self.edge_stats = np.zeros(self.n_edges, dtype=COMPACT_EDGE_STATS_DTYPE if compact else EDGE_STATS_DTYPE)
+        self._bind_edge_stats()
+        self.prior_edge = np.zeros(self.n_edges)
+
+        self.N_node = np.zeros(self.n_nodes, dtype=int)
+        self.V_node = np.zeros(self.n_nodes)
+        self.mean_node = np.zeros(self.n_nodes)
 
-            if algorithm == "w-mcts" or algorithm == "w-uct":
-                self._tree[e[0]][e[1]]['q_mean'] = 0.
-                self._tree[e[0]][e[1]]['q_variance'] = 0.5
+        # The algorithm-specific statistics are allocated for every algorithm, so that the compiled MCTS kernel can
+        # always be called with the same set of arrays.
+        self.q_mean_edge = np.zeros(self.n_edges)
+        self.q_variance_edge = np.full(self.n_edges, .5)
 
-        for n in self._tree.nodes:
-            self._tree.nodes[n]['N'] = 0
-            self._tree.nodes[n]['V'] = 0.
+        self.v_mean_node = np.zeros(self.n_nodes)
+        self.v_variance_node = np.full(self.n_nodes, .5)
 
-            if algorithm == "w-mcts":
-                self._tree.nodes[n]['v_mean'] = 0.
-                self._tree.nodes[n]['v_variance'] = 0.5
-            elif algorithm == "dng":
-                self._tree.nodes[n]["mu"] = 0.
-                self._tree.nodes[n]["lambda"] = 1e-2
-                self._tree.nodes[n]["alpha"] = 1.
-                self._tree.nodes[n]["beta"] = 100.
+        self.mu_node = np.zeros(self.n_nodes)
+        self.lambda_node = np.full(self.n_nodes, 1e-2)
+        self.alpha_node = np.ones(self.n_nodes)
+        self.beta_node = np.full(self.n_nodes, 100.)
 
-        self.leaves = [x for x in self._tree.nodes() if
-                       self._tree.out_degree(x) == 0 and self._tree.in_degree(x) == 1]
+        self.rollout_std = .5
+        # self.rollout_std = .05
 
         self._compute_mean()
-        means = np.array([self._tree.nodes[n]['mean'] for n in self.leaves])
+        means = self.mean_node[self.first_leaf_idx:]
         means = (means - means.min()) / (means.max() - means.min()) if len(means) > 1 else [0.]
-        for i, n in enumerate(self.leaves):
-            self._tree.nodes[n]['mean'] = means[i]
+        self.mean_node[self.first_leaf_idx:] = means
 
-        self.max_mean = 0
-        for leaf in self.leaves:
-            self.max_mean = max(self.max_mean, self._tree.nodes[leaf]['mean'])
+        self.max_mean = max(0, self.mean_node[self.first_leaf_idx:].max())
 
         self._assign_priors_maxs()
 
@@ -68,6 +81,23 @@ class SyntheticTree:
 
         self.reset()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('N_edge', 'Q_edge', 'Q_tau_edge'):
+            del state[name]
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._bind_edge_stats()
+
+    def _bind_edge_stats(self):
+        """Binds the per-field views on the interleaved edge statistics, which do not survive pickling as views."""
+        self.N_edge = self.edge_stats['N']
+        self.Q_edge = self.edge_stats['Q']
+        self.Q_tau_edge = self.edge_stats['Q_tau']
+
     def reset(self, state=None):
         """Resets the active state of the tree.
 
@@ -91,109 +121,105 @@ class SyntheticTree:
         Returns:
             The new active state of the tree.
         """
-        edges = [e for e in self._tree.edges(self.state)]
-        self.state = edges[action][1]
+        self.state = self.state * self._k + action + 1
 
         return self.state
 
-    def rollout(self, state):
+    def rollout(self, state, eps):
         """Computes the return of a random rollout starting in the given state.
 
         Simulates a random rollout by taking a sample from a normal distribution centerd at the pre-computed mean
-        return of the given state.
+        return of the given state. The standard normal noise is passed in, so that callers can sample it in bulk.
 
         Args:
             state (int): The state from which to rollout.
+            eps (float): A sample from the standard normal distribution.
         Returns:
             The return of the rollout.
         """
-        return np.random.normal(self._tree.nodes[state]['mean'], scale=.5)
-        # return np.random.normal(self._tree.nodes[state]['mean'], scale=.05)
+        return self.mean_node[state] + self.rollout_std * eps
 
     @property
-    def tree(self):
-        return self._tree
+    def k(self):
+        return self._k
 
-    def _compute_mean(self, node=0, weight=0):
-        """Recursively computes and assigns the mean returns at each leaf node of the tree.
+    @property
+    def d(self):
+        return self._d
 
-        Cmputes the cumulative sum of rewards when going from the root node to each leaf node. These are then assigned
-        to each respective leaf node as it's mean return.
-        """
-        if node not in self.leaves:
-            for e in self._tree.edges(node):
-                self._compute_mean(e[1],
-                                   weight + self._tree[e[0]][e[1]]['weight'])
-        else:
-            self._tree.nodes[node]['mean'] = weight
+    def is_leaf(self, state):
+        """Returns whether the given state is a leaf, i.e. one of the last k^d nodes of the breadth-first numbering."""
+        return state >= self.first_leaf_idx
 
-    def _assign_priors_maxs(self, node=0):
-        """Recursively computes and assigns the mean returns and priors at each intermediate node in the tree."""
-        successors = [n for n in self._tree.successors(node)]
-        if successors[0] not in self.leaves:
-            means = np.array([self._assign_priors_maxs(s) for s in successors])
-            self._tree.nodes[node]['prior'] = means / means.sum()
-            self._tree.nodes[node]['mean'] = means.max()
+    def edges(self, state):
+        """Returns the slice of the edge arrays holding the outgoing edges of the given state."""
+        return slice(state * self._k, state * self._k + self._k)
 
-            return means.max()
-        else:
-            means = np.array([self._tree.nodes[s]['mean'] for s in successors])
-            self._tree.nodes[node]['prior'] = means / means.sum()
-            self._tree.nodes[node]['mean'] = means.max()
+    def _compute_mean(self):
+        """Computes and assigns the mean returns at each leaf node of the tree.
 
-            return means.max()
+        Cmputes the cumulative sum of rewards when going from the root node to each leaf node, one level of the tree at
+        a time. These are then assigned to each respective leaf node as it's mean return.
+        """
+        for l in range(1, self._d + 1):
+            parents = slice(self._level_starts[l - 1], self._level_starts[l])
+            nodes = slice(self._level_starts[l], self._level_starts[l + 1])
+            edges = slice(self._level_starts[l] - 1, self._level_starts[l + 1] - 1)
+            self.mean_node[nodes] = np.repeat(self.mean_node[parents], self._k) + self.weight_edge[edges]
+
+    def _assign_priors_maxs(self):
+        """Computes and assigns the mean returns and priors at each intermediate node in the tree, bottom-up."""
+        for l in reversed(range(self._d)):
+            parents = slice(self._level_starts[l], self._level_starts[l + 1])
+            edges = slice(self._level_starts[l + 1] - 1, self._level_starts[l + 2] - 1)
+            means = self.mean_node[self._level_starts[l + 1]:self._level_starts[l + 2]].reshape(-1, self._k)
+            self.prior_edge[edges] = (means / means.sum(axis=1, keepdims=True)).ravel()
+            self.mean_node[parents] = means.max(axis=1)
 
     def _solver(self, node=0):
         if self._algorithm == 'w-mcts':
-            successors = [n for n in self._tree.successors(node)]
-            means = np.array([self._tree.nodes[s]['mean'] for s in successors])
+            means = self.mean_node[self.children[node]]
 
             return self.max_mean, means
         elif self._algorithm == 'dng':
-            successors = [n for n in self._tree.successors(node)]
-            means = np.array([self._tree.nodes[s]['mean'] for s in successors])
+            means = self.mean_node[self.children[node]]
 
             return self.max_mean, means
         elif self._algorithm == 'uct':
-            successors = [n for n in self._tree.successors(node)]
-            means = np.array([self._tree.nodes[s]['mean'] for s in successors])
+            means = self.mean_node[self.children[node]]
 
             return self.max_mean, means
         else:
-            successors = [n for n in self._tree.successors(node)]
+            successors = self.children[node]
             if self._algorithm == 'ments':
-                if successors[0] in self.leaves:
-                    x = np.array([self._tree.nodes[n]['mean'] for n in self._tree.successors(node)])
+                if self.is_leaf(successors[0]):
+                    x = self.mean_node[successors]
 
                     return self._tau * logsumexp(x / self._tau), x
                 else:
-                    x = np.array([self._solver(n)[0] for n in self._tree.successors(node)])
+                    x = np.array([self._solver(n)[0] for n in successors])
 
                     return self._tau * logsumexp(x / self._tau), x
             elif self._algorithm == 'rents':
-                if successors[0] in self.leaves:
-                    x = np.array([self._tree.nodes[n]['mean'] for n in self._tree.successors(node)])
+                if self.is_leaf(successors[0]):
+                    x = self.mean_node[successors]
 
-                    return self._tau * np.log(np.sum(self._tree.nodes[node]['prior'] * np.exp(x / self._tau))), x
+                    return self._tau * np.log(np.sum(self.prior_edge[self.edges(node)] * np.exp(x / self._tau))), x
                 else:
-                    x = np.array([self._solver(n)[0] for n in self._tree.successors(node)])
+                    x = np.array([self._solver(n)[0] for n in successors])
 
-                    return self._tau * np.log(np.sum(self._tree.nodes[node]['prior'] * np.exp(x / self._tau))), x
+                    return self._tau * np.log(np.sum(self.prior_edge[self.edges(node)] * np.exp(x / self._tau))), x
             elif self._algorithm == 'alpha-divergence':
                 def sparse_max_alpha_divergence(means_tau):
-                    temp_means_tau = means_tau.copy()
-                    sorted_means = np.flip(np.sort(temp_means_tau))
-                    kappa = list()
-                    for i in range(1, len(sorted_means) + 1):
-                        if self._alpha + i * sorted_means[i-1] > sorted_means[:i].sum() + i * (self._alpha - (self._alpha/(self._alpha-1))):
-                            idx = np.argwhere(temp_means_tau == sorted_means[i-1]).ravel()[0]
-                            temp_means_tau[idx] = np.nan
-                            kappa.append(idx)
-                    kappa = np.array(kappa)
+                    order = np.argsort(means_tau)[::-1]
+                    sorted_means = means_tau[order]
+                    i = np.arange(1, len(sorted_means) + 1)
+                    support = self._alpha + i * sorted_means > np.cumsum(sorted_means) + i * (self._alpha - (self._alpha/(self._alpha-1)))
+                    kappa = order[support]
 
                     c_s_tau = ((means_tau[kappa].sum() - self._alpha) / len(kappa)) + (self._alpha - (self._alpha/(self._alpha-1)))
 
-                    max_omega_tmp = np.maximum(means_tau - c_s_tau, np.zeros(len(means_tau)))
+                    max_omega_tmp = np.maximum(means_tau - c_s_tau, 0)
                     max_omega = np.power(max_omega_tmp * ((self._alpha - 1)/self._alpha), 1/(self._alpha))
                     max_omega = max_omega/np.sum(max_omega)
 
@@ -203,39 +229,35 @@ class SyntheticTree:
 
                     return sparse_max
 
-                if successors[0] in self.leaves:
-                    x = np.array([self._tree.nodes[n]['mean'] for n in self._tree.successors(node)])
+                if self.is_leaf(successors[0]):
+                    x = self.mean_node[successors]
 
                     return self._tau * sparse_max_alpha_divergence(x / self._tau), x
                 else:
-                    x = np.array([self._solver(n)[0] for n in self._tree.successors(node)])
+                    x = np.array([self._solver(n)[0] for n in successors])
 
-                    return self._tau * sparse_max_alpha_divergence(np.array(x / self._tau)), x
+                    return self._tau * sparse_max_alpha_divergence(x / self._tau), x
             elif self._algorithm == 'tents':
                 def sparse_max(means_tau):
-                    temp_means_tau = means_tau.copy()
-                    sorted_means = np.flip(np.sort(temp_means_tau))
-                    kappa = list()
-                    for i in range(1, len(sorted_means) + 1):
-                        if 1 + i * sorted_means[i-1] > sorted_means[:i].sum():
-                            idx = np.argwhere(temp_means_tau == sorted_means[i-1]).ravel()[0]
-                            temp_means_tau[idx] = np.nan
-                            kappa.append(idx)
-                    kappa = np.array(kappa)
+                    order = np.argsort(means_tau)[::-1]
+                    sorted_means = means_tau[order]
+                    cumsum_means = np.cumsum(sorted_means)
+                    k_support = (1 + np.arange(1, len(sorted_means) + 1) * sorted_means > cumsum_means).sum()
+                    kappa = order[:k_support]
 
                     sparse_max = means_tau[kappa] ** 2 / 2 - (
-                        means_tau[kappa].sum() - 1) ** 2 / (2 * len(kappa) ** 2)
+                        cumsum_means[k_support - 1] - 1) ** 2 / (2 * k_support ** 2)
                     sparse_max = sparse_max.sum() + .5
 
                     return sparse_max
 
-                if successors[0] in self.leaves:
-                    x = np.array([self._tree.nodes[n]['mean'] for n in self._tree.successors(node)])
+                if self.is_leaf(successors[0]):
+                    x = self.mean_node[successors]
 
                     return self._tau * sparse_max(x / self._tau), x
                 else:
-                    x = np.array([self._solver(n)[0] for n in self._tree.successors(node)])
+                    x = np.array([self._solver(n)[0] for n in successors])
 
-                    return self._tau * sparse_max(np.array(x / self._tau)), x
+                    return self._tau * sparse_max(x / self._tau), x
             else:
                 raise ValueError